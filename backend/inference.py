@@ -0,0 +1,245 @@
+# backend/inference.py
+# 模型推論：預設在 API 行程內執行；設定 INFERENCE_SOCKET 後改由獨立的推論伺服器
+# （python -m backend.inference）以 worker pool 持有模型與 scaler，API 行程不載入 TensorFlow。
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+from functools import lru_cache
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge, wait
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+env_path = Path(__file__).resolve().parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET")  # Unix socket 路徑，未設定則在行程內推論
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "1"))  # 每個 worker 的 intra-op 執行緒數
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))  # 等待推論結果的秒數
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY")  # API 與推論伺服器共用的驗證金鑰
+
+if INFERENCE_SOCKET and not INFERENCE_AUTHKEY:
+    raise ValueError("❌ INFERENCE_AUTHKEY not set!")
+
+base_dir = Path(__file__).resolve().parent.parent
+
+scaler_path = base_dir / "backend" / "data" / "rnn_scaler_smote.pkl"
+model_path = base_dir / "backend" / "data" / "rnn_model_smote.h5"
+model_path_Africa = base_dir / "backend" / "data" / "rnn_model_Africa.h5"
+model_path_Asia = base_dir / "backend" / "data" / "rnn_model_Asia.h5"
+model_path_Europe = base_dir / "backend" / "data" / "rnn_model_Europe.h5"
+model_path_NorthAmerica = base_dir / "backend" / "data" / "rnn_model_North America.h5"
+model_path_SouthAmerica = base_dir / "backend" / "data" / "rnn_model_South America.h5"
+model_path_Oceania = base_dir / "backend" / "data" / "rnn_model_Oceania.h5"
+model_path_Other = base_dir / "backend" / "data" / "rnn_model_Other.h5"
+
+
+class InferenceError(RuntimeError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_scaler():
+    import joblib
+    return joblib.load(scaler_path)
+
+
+@lru_cache(maxsize=None)
+def get_model(continent: str):
+    # 延遲載入 TensorFlow，只有實際執行推論的行程才需要
+    from tensorflow.keras.models import load_model
+
+    path_map = {
+        "africa": model_path_Africa,
+        "asia": model_path_Asia,
+        "europe": model_path_Europe,
+        "north america": model_path_NorthAmerica,
+        "south america": model_path_SouthAmerica,
+        "oceania": model_path_Oceania,
+        "other": model_path_Other,
+        "global": model_path
+    }
+    model_path_to_load = path_map.get(continent, model_path_Other)
+    return load_model(model_path_to_load)
+
+
+def run_models(features, continents):
+    """對 (n, 14) 的特徵一次 scale，並以各模型批次推論，回傳 {continent: 機率陣列}"""
+    features = np.asarray(features, dtype=float).reshape(-1, 14)
+    scaled = get_scaler().transform(features)
+    rnn_input = scaled.reshape((scaled.shape[0], 1, scaled.shape[1]))
+
+    return {
+        continent: get_model(continent).predict(rnn_input, batch_size=len(rnn_input), verbose=0)[:, 0]
+        for continent in continents
+    }
+
+
+def predict_proba(features, continents):
+    continents = [c.strip().lower() for c in continents]
+    if not INFERENCE_SOCKET:
+        return run_models(features, continents)
+
+    authkey = INFERENCE_AUTHKEY.encode()
+    try:
+        with Client(INFERENCE_SOCKET, family="AF_UNIX") as conn:
+            # 自行完成驗證握手，才能在每次等待前加上 timeout
+            if not conn.poll(INFERENCE_TIMEOUT):
+                raise InferenceError("Inference server handshake timed out")
+            answer_challenge(conn, authkey)
+            deliver_challenge(conn, authkey)
+
+            conn.send((np.asarray(features, dtype=float), continents))
+            if not conn.poll(INFERENCE_TIMEOUT):
+                raise InferenceError("Inference request timed out")
+            status, result = conn.recv()
+    except (OSError, EOFError, mp.AuthenticationError) as e:
+        raise InferenceError(f"Inference server unavailable: {e}")
+
+    if status != "ok":
+        raise InferenceError(result)
+    return result
+
+
+# ---- 推論伺服器 ----
+
+def worker_main(conn, threads: int):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    get_scaler()
+    for continent in ["global", "africa", "asia", "europe", "north america",
+                      "south america", "oceania", "other"]:
+        get_model(continent)
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            features, continents = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send(("ok", run_models(features, continents)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class WorkerPool:
+    def __init__(self, size: int, threads: int):
+        self.ctx = mp.get_context("spawn")
+        self.threads = threads
+        self.lock = threading.Lock()
+        # 只放已載入完模型的 worker：(slot, process, conn)
+        self.idle = queue.Queue()
+        self.workers = {}
+        for slot in range(size):
+            self.start_worker(slot)
+        threading.Thread(target=self.supervise, daemon=True).start()
+
+    def start_worker(self, slot: int):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(target=worker_main, args=(child_conn, self.threads), daemon=True)
+        process.start()
+        child_conn.close()
+        self.workers[slot] = (process, parent_conn)
+        threading.Thread(target=self.await_ready, args=(slot, process, parent_conn), daemon=True).start()
+
+    def await_ready(self, slot: int, process, conn):
+        # 模型載入完成後才加入 idle，避免請求等待重啟中的 worker
+        try:
+            if conn in wait([conn, process.sentinel]):
+                status, _ = conn.recv()
+                if status == "ready":
+                    self.idle.put((slot, process, conn))
+        except (OSError, EOFError):
+            pass
+
+    def supervise(self):
+        # worker 一結束（sentinel 就緒）就立即重啟
+        while True:
+            with self.lock:
+                sentinels = {process.sentinel: slot for slot, (process, _) in self.workers.items()}
+            for sentinel in wait(list(sentinels), timeout=1):
+                self.restart_worker(sentinels[sentinel])
+
+    def restart_worker(self, slot: int):
+        with self.lock:
+            process, conn = self.workers[slot]
+            conn.close()
+            process.join()
+            print(f"⚠️ Inference worker {slot} (pid {process.pid}) exited with {process.exitcode}, restarting")
+        time.sleep(1)  # 避免啟動即失敗時快速重啟迴圈
+        with self.lock:
+            self.start_worker(slot)
+
+    def checkout(self):
+        deadline = time.monotonic() + INFERENCE_TIMEOUT
+        while True:
+            try:
+                slot, process, conn = self.idle.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise InferenceError("No inference worker available")
+            # 已被重啟取代或已結束的 worker 直接丟棄
+            if process.is_alive() and self.workers.get(slot, (None,))[0] is process:
+                return slot, process, conn
+
+    def submit(self, features, continents):
+        for attempt in range(2):
+            try:
+                slot, process, conn = self.checkout()
+            except InferenceError as e:
+                return ("error", str(e))
+            try:
+                conn.send((features, continents))
+                if not conn.poll(INFERENCE_TIMEOUT):
+                    # 卡住的 worker 直接結束，由 supervise 重啟
+                    process.kill()
+                    return ("error", "Inference request timed out")
+                result = conn.recv()
+            except (OSError, EOFError):
+                # worker 在處理中結束：由 supervise 重啟，這批請求改送其他 worker 重試一次
+                continue
+            self.idle.put((slot, process, conn))
+            return result
+        return ("error", "Inference worker crashed")
+
+
+def handle_client(pool: WorkerPool, conn, authkey: bytes):
+    with conn:
+        try:
+            # 驗證握手在各自的執行緒中進行，單一異常的連線不會影響 accept 迴圈
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+            if not conn.poll(INFERENCE_TIMEOUT):
+                return
+            features, continents = conn.recv()
+            conn.send(pool.submit(features, continents))
+        except (OSError, EOFError, mp.AuthenticationError):
+            pass
+
+
+def serve(address: str, workers: int, threads: int):
+    if os.path.exists(address):
+        os.unlink(address)
+
+    authkey = INFERENCE_AUTHKEY.encode()
+    pool = WorkerPool(workers, threads)
+    print(f"🚀 Inference server listening on {address} ({workers} workers, {threads} threads each)")
+    with Listener(address, family="AF_UNIX") as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                continue
+            threading.Thread(target=handle_client, args=(pool, conn, authkey), daemon=True).start()
+
+
+if __name__ == "__main__":
+    if not INFERENCE_SOCKET:
+        raise ValueError("❌ INFERENCE_SOCKET not set!")
+    serve(INFERENCE_SOCKET, INFERENCE_WORKERS, INFERENCE_THREADS)
@@ -1,22 +1,21 @@
 # backend/main.py
 from fastapi import FastAPI, Depends, HTTPException, Query, Body
 from sqlalchemy.orm import Session
-from . import models, schemas, crud, database
+from . import models, schemas, crud, database, inference
 from .database import SessionLocal, engine, Base
 from fastapi import Query
 from typing import Optional
 from pydantic import BaseModel
-import joblib
 import numpy as np
-from tensorflow.keras.models import load_model
 from pathlib import Path
 from fastapi.middleware.cors import CORSMiddleware
 import pandas as pd
 import pycountry
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+import json
 import plotly.express as px
 import pycountry_convert as pc
-from functools import lru_cache
 from typing import Any, List, Dict, Optional
 
 Base.metadata.create_all(bind=engine)
@@ -33,27 +32,6 @@ app.add_middleware(
 # 確保從 main.py 相對位置推回根目錄
 base_dir = Path(__file__).resolve().parent.parent
 
-scaler_path = base_dir / "backend" / "data" / "rnn_scaler_smote.pkl"
-model_path = base_dir / "backend" / "data" / "rnn_model_smote.h5"
-model_path_Africa = base_dir / "backend" / "data" / "rnn_model_Africa.h5"
-model_path_Asia = base_dir / "backend" / "data" / "rnn_model_Asia.h5"
-model_path_Europe = base_dir / "backend" / "data" / "rnn_model_Europe.h5"
-model_path_NorthAmerica = base_dir / "backend" / "data" / "rnn_model_North America.h5"
-model_path_SouthAmerica = base_dir / "backend" / "data" / "rnn_model_South America.h5"
-model_path_Oceania = base_dir / "backend" / "data" / "rnn_model_Oceania.h5"
-model_path_Other = base_dir / "backend" / "data" / "rnn_model_Other.h5"
-
-scaler = joblib.load(scaler_path)
-# rnn_model = load_model(model_path)
-# rnn_model_Africa = load_model(model_path_Africa)
-# rnn_model_Asia = load_model(model_path_Asia)
-# rnn_model_Europe = load_model(model_path_Europe)
-# rnn_model_NorthAmerica = load_model(model_path_NorthAmerica)
-# rnn_model_SouthAmerica = load_model(model_path_SouthAmerica)
-# rnn_model_Oceania = load_model(model_path_Oceania)
-# rnn_model_Other = load_model(model_path_Other)
-
-
 csv_path = base_dir / "backend" / "data" / "agri_CO2_preprocessing_ex.csv"
 df = pd.read_csv(csv_path)
 
@@ -123,21 +101,6 @@ manual_country_to_continent = {
     'United States of America': 'North America',
 }
 
-@lru_cache(maxsize=None)
-def get_model(continent: str):
-    path_map = {
-        "africa": model_path_Africa,
-        "asia": model_path_Asia,
-        "europe": model_path_Europe,
-        "north america": model_path_NorthAmerica,
-        "south america": model_path_SouthAmerica,
-        "oceania": model_path_Oceania,
-        "other": model_path_Other,
-        "global": model_path
-    }
-    model_path_to_load = path_map.get(continent, model_path_Other)
-    return load_model(model_path_to_load)
-
 def get_continent(country_name):
     try:
         country = pycountry.countries.lookup(country_name)
@@ -169,11 +132,54 @@ def get_iso_alpha(country_name):
         return None
 
 df["iso_alpha"] = df["Area"].apply(get_iso_alpha)
-df = df[df["iso_alpha"].notnull()]
+df = df[df["iso_alpha"].notnull()].copy()
+df["continent"] = df["Area"].apply(get_continent)
         
 class InputData(BaseModel):
     continent: str  # 新增：洲別（如 Asia、Europe 等）
     features: list[float]  # 14 個數值
+
+# 模型輸入的 14 個特徵（順序與 PredictDashboard / scaler 一致）與對應的 CSV 欄位
+feature_columns = {
+    "savanna_fires": "Savanna fires",
+    "forest_fires": "Forest fires",
+    "fires_organic": "Fires in organic soils",
+    "rice_cultivation": "Rice Cultivation",
+    "food_retail": "Food Retail",
+    "food_transport": "Food Transport",
+    "pesticides": "Pesticides Manufacturing",
+    "forestland": "Forestland",
+    "net_forest_conversion": "Net Forest conversion",
+    "manure_applied": "Manure applied to Soils",
+    "manure_left": "Manure left on Pasture",
+    "onfarm_electricity": "On-farm Electricity Use",
+    "ippu": "IPPU",
+    "drained_soils": "Drained organic soils (CO2)",
+}
+feature_keys = list(feature_columns)
+
+MAX_SWEEP_STEPS = 200
+MAX_BUNDLE_YEARS = 50
+MAX_BUNDLE_TOP_N = 50
+
+# 可用於排名的指標：p_emission_data 中除了 id / area / year 以外的數值欄位
+bundle_indicators = [
+    c.name for c in models.PEmissionData.__table__.columns
+    if c.name not in ("id", "area", "year")
+]
+
+class SweepAxis(BaseModel):
+    feature: str  # feature_keys 其中之一（或 CSV 欄位名稱）
+    start: float
+    stop: float
+    steps: int = 20
+
+class SweepData(BaseModel):
+    continent: Optional[str] = None
+    features: Optional[list[float]] = None  # 14 個數值的基準點
+    area: Optional[str] = None  # 或以資料集中的 area/year 作為基準點
+    year: Optional[int] = None
+    vary: list[SweepAxis]  # 1 或 2 個要變動的特徵
     
 def get_iso_alpha(country_name):
     try:
@@ -222,17 +228,13 @@ def predict_emission(data: InputData):
     try:
         continent = data.continent.strip().lower()
 
-        region_model = get_model(continent)
-        global_model = get_model("global")
-
         input_array = np.array(data.features).reshape(1, -1)
-        scaled = scaler.transform(input_array)
-        rnn_input = scaled.reshape((1, 1, scaled.shape[1]))
+        probs = inference.predict_proba(input_array, [continent, "global"])
 
-        prob_region = region_model.predict(rnn_input)[0][0]
+        prob_region = probs[continent][0]
         label_region = int(prob_region > 0.5)
 
-        prob_global = global_model.predict(rnn_input)[0][0]
+        prob_global = probs["global"][0]
         label_global = int(prob_global > 0.5)
 
         return {
@@ -251,12 +253,79 @@ def predict_emission(data: InputData):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def resolve_feature_index(name: str) -> int:
+    key = name.strip()
+    if key in feature_columns:
+        return feature_keys.index(key)
+    for i, column in enumerate(feature_columns.values()):
+        if column.lower() == key.lower():
+            return i
+    raise HTTPException(status_code=400, detail=f"Invalid feature: {name}")
+
+def get_baseline_features(area: str, year: int) -> np.ndarray:
+    row = df[(df["Area"] == area) & (df["Year"] == year)]
+    if row.empty:
+        raise HTTPException(status_code=404, detail=f"No data found for {area} in {year}")
+    values = pd.to_numeric(row.iloc[0][list(feature_columns.values())], errors="coerce")
+    return values.fillna(0.0).to_numpy(dtype=float)
+
+@app.post("/predict/sweep")
+def predict_sweep(data: SweepData):
+    if not 1 <= len(data.vary) <= 2:
+        raise HTTPException(status_code=400, detail="vary 必須為 1 或 2 個特徵")
+
+    if data.features is not None:
+        if len(data.features) != 14:
+            raise HTTPException(status_code=400, detail="features 必須為 14 個數值")
+        baseline = np.array(data.features, dtype=float)
+    elif data.area is not None and data.year is not None:
+        baseline = get_baseline_features(data.area, data.year)
+    else:
+        raise HTTPException(status_code=400, detail="請提供 features 或 area 與 year")
+
+    continent = data.continent or (get_continent(data.area) if data.area else None) or "Other"
+
+    indices = [resolve_feature_index(axis.feature) for axis in data.vary]
+    if len(set(indices)) != len(indices):
+        raise HTTPException(status_code=400, detail="vary 的特徵不可重複")
+    for axis in data.vary:
+        if not 1 <= axis.steps <= MAX_SWEEP_STEPS:
+            raise HTTPException(status_code=400, detail=f"steps 必須介於 1 與 {MAX_SWEEP_STEPS} 之間")
+
+    axes = [np.linspace(axis.start, axis.stop, axis.steps) for axis in data.vary]
+    shape = tuple(len(a) for a in axes)
+
+    # 一次建立整個網格，所有點共用同一次 scaler.transform 與模型批次推論
+    grid = np.tile(baseline, (int(np.prod(shape)), 1))
+    for idx, mesh in zip(indices, np.meshgrid(*axes, indexing="ij")):
+        grid[:, idx] = mesh.ravel()
+
+    try:
+        region = continent.strip().lower()
+        probs = inference.predict_proba(grid, [region, "global"])
+
+        prob_region = probs[region]
+        prob_global = probs["global"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "continent": continent,
+        "baseline": baseline.tolist(),
+        "axes": [
+            {"feature": feature_keys[idx], "values": values.tolist()}
+            for idx, values in zip(indices, axes)
+        ],
+        "shape": list(shape),
+        "region_probability": np.round(prob_region.reshape(shape), 4).tolist(),
+        "global_probability": np.round(prob_global.reshape(shape), 4).tolist(),
+    }
+
 @app.get("/data/global_data")
 def get_global_data(year: int):
+    # iso_alpha / continent 已在載入時計算
     year_df = df[df["Year"] == year].copy()
 
-    year_df["iso_alpha"] = year_df["Area"].apply(get_iso_alpha)
-    year_df["continent"] = year_df["Area"].apply(get_continent)
     year_df["total_emission"] = pd.to_numeric(year_df["total_emission"], errors="coerce")
 
     # Normalize for bubble size
@@ -269,6 +338,83 @@ def get_global_data(year: int):
 
     return year_df[["iso_alpha", "Area", "continent", "total_emission"]].to_dict(orient="records")
 
+def sse_event(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(payload), separators=(',', ':'))}\n\n"
+
+def iter_year_bundle(start_year: int, end_year: int, indicators: List[str], top_n: int, delta: bool):
+    range_df = df[(df["Year"] >= start_year) & (df["Year"] <= end_year)].dropna(subset=["continent"])
+    range_df = range_df.assign(total_emission=pd.to_numeric(range_df["total_emission"], errors="coerce"))
+
+    # 國家資訊（ISO-3、洲別）只送一次，之後每年的數值以相同順序的陣列表示
+    areas = range_df[["Area", "iso_alpha", "continent"]].drop_duplicates("Area").sort_values("Area")
+    area_index = pd.Index(areas["Area"])
+    yield sse_event("meta", {
+        "years": [start_year, end_year],
+        "areas": areas["Area"].tolist(),
+        "iso_alpha": areas["iso_alpha"].tolist(),
+        "continent": areas["continent"].tolist(),
+        "indicators": indicators,
+        "delta": delta,
+    })
+
+    db = SessionLocal()
+    try:
+        previous = None
+        for year in range(start_year, end_year + 1):
+            values = (
+                range_df[range_df["Year"] == year]
+                .drop_duplicates("Area")
+                .set_index("Area")["total_emission"]
+                .reindex(area_index)
+                .to_numpy(dtype=float)
+            )
+            if delta and previous is not None:
+                # 與前一年相減（前一年缺值視為 0），前端累加即可還原
+                encoded = values - np.nan_to_num(previous)
+            else:
+                encoded = values
+            previous = values
+
+            yield sse_event("year", {
+                "year": year,
+                "total_emission": [None if np.isnan(v) else round(float(v), 4) for v in encoded],
+                "summary": crud.get_yearly_summary(db, year),
+                "top": {
+                    ind: crud.get_top_countries_by_indicator(db, year, ind, top_n)
+                    for ind in indicators
+                },
+            })
+        yield sse_event("end", {"years": [start_year, end_year]})
+    except Exception as e:
+        # 串流已開始，無法再改 HTTP 狀態碼，改以 error 事件通知前端
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        db.close()
+
+@app.get("/data/year_bundle")
+def year_bundle(
+    start_year: int,
+    end_year: int,
+    indicators: Optional[List[str]] = Query(None),
+    top_n: int = Query(5, ge=1, le=MAX_BUNDLE_TOP_N),
+    delta: bool = False,
+):
+    if start_year > end_year:
+        raise HTTPException(status_code=400, detail="start_year 不可大於 end_year")
+    if end_year - start_year + 1 > MAX_BUNDLE_YEARS:
+        raise HTTPException(status_code=400, detail=f"年份範圍最多 {MAX_BUNDLE_YEARS} 年")
+
+    indicators = indicators or feature_keys
+    for ind in indicators:
+        if ind not in bundle_indicators:
+            raise HTTPException(status_code=400, detail=f"Invalid indicator: {ind}")
+
+    return StreamingResponse(
+        iter_year_bundle(start_year, end_year, indicators, top_n, delta),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
 @app.get("/data/continent-bubble")
 def continent_bubble(year: int = 2020, db: Session = Depends(get_db)):
     return crud.get_continent_bubble_data(db, year)